@@ -0,0 +1,69 @@
+import os
+import sys
+import logging
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "jinaai/jina-embeddings-v2-base-en"
+MODELS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models'))
+ONNX_FP32_PATH = os.path.join(MODELS_DIR, "jina.onnx")
+ONNX_INT8_PATH = os.path.join(MODELS_DIR, "jina.int8.onnx")
+
+
+class PoolerWrapper(torch.nn.Module):
+    """Expose only the pooled embedding so the ONNX graph has a single output"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).pooler_output
+
+
+def export():
+    os.makedirs(MODELS_DIR, exist_ok=True)
+
+    logger.info(f"Loading {MODEL_NAME}...")
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModel.from_pretrained(MODEL_NAME, trust_remote_code=True)
+    model.eval()
+
+    dummy = tokenizer("Best time to visit Ha Long Bay", return_tensors="pt",
+                      truncation=True, max_length=512)
+
+    logger.info(f"Exporting FP32 ONNX graph to {ONNX_FP32_PATH}...")
+    torch.onnx.export(
+        PoolerWrapper(model),
+        (dummy["input_ids"], dummy["attention_mask"]),
+        ONNX_FP32_PATH,
+        opset_version=17,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["pooler_output"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "pooler_output": {0: "batch"},
+        },
+    )
+    logger.info("FP32 export complete")
+
+    logger.info(f"Quantizing to int8 at {ONNX_INT8_PATH}...")
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(ONNX_FP32_PATH, ONNX_INT8_PATH, weight_type=QuantType.QInt8)
+    logger.info("int8 quantization complete")
+
+
+if __name__ == "__main__":
+    try:
+        export()
+    except Exception as e:
+        logger.error(f"Export failed: {e}")
+        sys.exit(1)
@@ -1,10 +1,13 @@
 import json
+import re
 import numpy as np
 import logging
+from collections import OrderedDict
 from pinecone import Pinecone
 from neo4j import GraphDatabase
 from transformers import AutoTokenizer, AutoModel
 import torch
+import httpx
 from openai import OpenAI
 import config
 
@@ -20,60 +23,125 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Embedding model
-tokenizer = AutoTokenizer.from_pretrained("jinaai/jina-embeddings-v2-base-en")
-embedding_model = AutoModel.from_pretrained("jinaai/jina-embeddings-v2-base-en", trust_remote_code=True)
+EMBEDDING_MODEL_NAME = "jinaai/jina-embeddings-v2-base-en"
+tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+embedding_model = AutoModel.from_pretrained(EMBEDDING_MODEL_NAME, trust_remote_code=True)
 
-# Embedding cache
-embedding_cache = {}
+# Embedding cache: true LRU keyed by (model, normalized text) so hits stay
+# resident and entries can't go stale across model upgrades
+embedding_cache = OrderedDict()
 CACHE_MAX_SIZE = 1000
 
+# Politeness filler that doesn't change what the user is asking for
+STOPWORD_RE = re.compile(
+    r"\b(please|thank you|thanks|could you|can you|would you|"
+    r"i want to know|i would like to know|tell me)\b"
+)
+
+def normalize_query(text):
+    """Canonicalize query text so trivial variants share a cache key"""
+    q = text.lower().strip()
+    q = STOPWORD_RE.sub(' ', q)
+    q = re.sub(r"[?!.,;:]+", ' ', q)
+    q = re.sub(r"\s+", ' ', q).strip()
+    return q
+
+# Semantic answer cache: match paraphrased queries to cached answers by
+# cosine similarity over L2-normalized query embeddings. Rows are stored as
+# float16 to halve the memory swept per scan; similarities are computed in
+# float32 for accuracy.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+semantic_cache_matrix = np.empty((0, 768), dtype=np.float16)
+semantic_cache_answers = []
+
+def semantic_cache_lookup(q_vec):
+    """Return (answer, similarity) for the closest cached query, or (None, 0.0)"""
+    if semantic_cache_matrix.shape[0] == 0:
+        return None, 0.0
+    sims = semantic_cache_matrix.astype(np.float32) @ np.asarray(q_vec, dtype=np.float32)
+    best = int(np.argmax(sims))
+    best_sim = float(sims[best])
+    if best_sim >= SEMANTIC_CACHE_THRESHOLD:
+        return semantic_cache_answers[best], best_sim
+    return None, best_sim
+
+def semantic_cache_store(q_vec, answer):
+    """Store a (query embedding, answer) pair, evicting the oldest when full"""
+    global semantic_cache_matrix
+    row = np.asarray(q_vec, dtype=np.float16).reshape(1, -1)
+    semantic_cache_matrix = np.vstack([semantic_cache_matrix, row])
+    semantic_cache_answers.append(answer)
+    if semantic_cache_matrix.shape[0] > CACHE_MAX_SIZE:
+        semantic_cache_matrix = semantic_cache_matrix[1:]
+        semantic_cache_answers.pop(0)
+
 def embed_text(text):
-    """Generate normalized embedding with caching"""
+    """Generate normalized embedding with LRU caching"""
     # Check cache first
-    if text in embedding_cache:
+    key = (EMBEDDING_MODEL_NAME, normalize_query(text))
+    if key in embedding_cache:
         logger.info(f"Cache hit for query: {text[:50]}...")
-        return embedding_cache[text]
-    
+        embedding_cache.move_to_end(key)
+        return embedding_cache[key]
+
     inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
     with torch.no_grad():
         embeddings = embedding_model(**inputs).pooler_output
-    vec = embeddings[0].cpu().numpy()
-    
-    # Normalize vector
+    # Keep the embedding as a float32 ndarray (3KB) rather than a list of
+    # boxed Python floats; normalize in place
+    vec = embeddings[0].cpu().numpy().astype(np.float32, copy=False)
+
     norm = np.linalg.norm(vec)
-    if norm == 0:
-        normalized = vec.tolist()
-    else:
-        normalized = (vec / norm).tolist()
-    
-    # Store in cache with size limit
+    if norm != 0:
+        vec /= norm
+
+    # Store in cache, evicting the least-recently-used entry when full
     if len(embedding_cache) >= CACHE_MAX_SIZE:
-        # Remove oldest entry
-        embedding_cache.pop(next(iter(embedding_cache)))
-    embedding_cache[text] = normalized
-    
+        embedding_cache.popitem(last=False)
+    embedding_cache[key] = vec
+
     logger.info(f"Generated embedding for: {text[:50]}...")
-    return normalized
+    return vec
 
 # Initialize connections
 pc = Pinecone(api_key=config.PINECONE_API_KEY)
 index = pc.Index(config.PINECONE_INDEX_NAME)
 driver = GraphDatabase.driver(config.NEO4J_URI, auth=(config.NEO4J_USER, config.NEO4J_PASSWORD))
 
+# Persistent Groq client: one keep-alive connection pool for the whole
+# session instead of a fresh TLS handshake per call
+groq_client = OpenAI(
+    api_key=config.GROQ_API_KEY,
+    base_url="https://api.groq.com/openai/v1",
+    http_client=httpx.Client(
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    )
+)
+
 # Configuration
-SCORE_THRESHOLD = 0.7  # Only use high-quality matches
+SCORE_THRESHOLD = config.SCORE_THRESHOLD  # Only use high-quality matches
 
-def pinecone_query(query_text, top_k=5):
+def pinecone_query(query_text, top_k=5, vec=None):
     """Query Pinecone with error handling and score filtering"""
     try:
-        vec = embed_text(query_text)
-        res = index.query(vector=vec, top_k=top_k, include_metadata=True, include_values=False)
+        if vec is None:
+            vec = embed_text(query_text)
+        # Over-fetch so top_k high-quality matches survive the threshold
+        # filter; the SDK wants a plain list, convert at the boundary only
+        res = index.query(vector=np.asarray(vec).tolist(), top_k=top_k * 3,
+                          include_metadata=True, include_values=False)
         matches = res.get("matches", [])
-        
-        # Filter by score threshold
-        filtered_matches = [m for m in matches if m.get("score", 0) >= SCORE_THRESHOLD]
-        logger.info(f"Pinecone returned {len(matches)} matches, {len(filtered_matches)} above threshold")
-        
+        if not matches:
+            return []
+
+        # Filter by score threshold, vectorized
+        scores = np.fromiter((m.get("score", 0) for m in matches),
+                             dtype=np.float32, count=len(matches))
+        keep_idx = np.where(scores >= SCORE_THRESHOLD)[0][:top_k]
+        filtered_matches = [matches[i] for i in keep_idx]
+        logger.info(f"Pinecone returned {len(matches)} matches, {len(filtered_matches)} kept above threshold")
+
         return filtered_matches
     except Exception as e:
         logger.error(f"Pinecone query error: {e}")
@@ -83,82 +151,83 @@ def fetch_graph_context(node_ids, neighborhood_depth=1):
     """Fetch graph context with error handling"""
     facts = []
     try:
+        # Single UNWIND round-trip instead of one query per node id; the
+        # CALL subquery keeps the per-source LIMIT of the old loop
+        q = (
+            "UNWIND $nids AS nid "
+            "CALL { WITH nid MATCH (n:Entity {id:nid})-[r]-(m:Entity) "
+            "RETURN type(r) AS rel, labels(m) AS labels, m.id AS id, "
+            "m.name AS name, m.type AS type, m.description AS description "
+            "LIMIT 10 } "
+            "RETURN nid AS source, rel, labels, id, name, type, description"
+        )
         with driver.session() as session:
-            for nid in node_ids:
-                try:
-                    q = (
-                        "MATCH (n:Entity {id:$nid})-[r]-(m:Entity) "
-                        "RETURN type(r) AS rel, labels(m) AS labels, m.id AS id, "
-                        "m.name AS name, m.type AS type, m.description AS description "
-                        "LIMIT 10"
-                    )
-                    recs = session.run(q, nid=nid)
-                    for r in recs:
-                        facts.append({
-                            "source": nid,
-                            "rel": r["rel"],
-                            "target_id": r["id"],
-                            "target_name": r["name"],
-                            "target_desc": (r["description"] or "")[:400],
-                            "labels": r["labels"]
-                        })
-                except Exception as e:
-                    logger.warning(f"Error fetching context for node {nid}: {e}")
-                    continue
+            recs = session.run(q, nids=node_ids)
+            for r in recs:
+                facts.append({
+                    "source": r["source"],
+                    "rel": r["rel"],
+                    "target_id": r["id"],
+                    "target_name": r["name"],
+                    "target_desc": (r["description"] or "")[:80],
+                    "labels": r["labels"]
+                })
         logger.info(f"Fetched {len(facts)} graph facts")
     except Exception as e:
         logger.error(f"Neo4j connection error: {e}")
-    
+
     return facts
 
 def build_prompt(user_query, pinecone_matches, graph_facts):
-    """Build enhanced prompt with chain-of-thought instructions"""
+    """Build a compact prompt for the LLM
+
+    TTFT scales with input tokens, so the system prompt is kept short, graph
+    facts are deduplicated, and descriptions are truncated.
+    """
     system = (
-        "You are an expert Vietnam travel assistant with deep knowledge of Vietnamese culture, geography, and tourism. "
-        "Use the provided semantic search results and graph relationships to answer queries accurately and helpfully.\n\n"
-        "Instructions:\n"
-        "1. Always cite node IDs (in format 'node_XXX') when referencing specific places\n"
-        "2. Provide step-by-step reasoning for itinerary suggestions\n"
-        "3. Prioritize higher-scored results from the vector database\n"
-        "4. If information is uncertain or incomplete, acknowledge this clearly\n"
-        "5. Structure multi-day itineraries with clear daily breakdowns\n"
-        "6. Consider practical travel logistics (distances, timing, etc.)"
+        "Vietnam travel expert. Cite node IDs, reason step-by-step, "
+        "structure itineraries by day. Be concise."
     )
-    
+
     vec_context = []
     for m in pinecone_matches:
         meta = m["metadata"]
-        score = m.get("score", 0)
-        snippet = f"- [Node {m['id']}] {meta.get('name','')} ({meta.get('type','')}) - Score: {score:.3f}"
+        snippet = f"- [Node {m['id']}] {meta.get('name','')} ({meta.get('type','')})"
         if meta.get("city"):
             snippet += f" | City: {meta.get('city')}"
         vec_context.append(snippet)
-    
-    graph_context = [
-        f"- Node {f['source']} --[{f['rel']}]--> Node {f['target_id']}: {f['target_name']} - {f['target_desc'][:100]}..."
-        for f in graph_facts[:20]
-    ]
-    
+
+    # The undirected graph query can return the same fact via several
+    # sources; dedupe before spending tokens on it
+    seen = set()
+    graph_context = []
+    for f in graph_facts:
+        fact_key = (f['source'], f['rel'], f['target_id'])
+        if fact_key in seen:
+            continue
+        seen.add(fact_key)
+        graph_context.append(
+            f"- Node {f['source']} --[{f['rel']}]--> Node {f['target_id']}: "
+            f"{f['target_name']} - {f['target_desc']}"
+        )
+        if len(graph_context) >= 15:
+            break
+
     prompt = [
         {"role": "system", "content": system},
         {"role": "user", "content":
             f"User Query: {user_query}\n\n"
             "=== Semantic Search Results (Vector DB) ===\n" + "\n".join(vec_context[:10]) + "\n\n"
             "=== Graph Relationships (Knowledge Graph) ===\n" + "\n".join(graph_context) + "\n\n"
-            "Based on the above information, provide a comprehensive answer. "
-            "Include specific node IDs and explain your reasoning step-by-step."
+            "Answer with specific node IDs."
         }
     ]
     return prompt
 
 def call_groq_chat(prompt_messages):
-    """Call Groq API with error handling"""
+    """Call Groq API, returning None on failure so callers never cache errors"""
     try:
-        client = OpenAI(
-            api_key=config.GROQ_API_KEY,
-            base_url="https://api.groq.com/openai/v1"
-        )
-        response = client.chat.completions.create(
+        response = groq_client.chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=prompt_messages,
             max_tokens=800,
@@ -167,7 +236,7 @@ def call_groq_chat(prompt_messages):
         return response.choices[0].message.content
     except Exception as e:
         logger.error(f"Groq API error: {e}")
-        return "I apologize, but I'm having trouble generating a response right now. Please try again."
+        return None
 
 def interactive_chat():
     """Interactive chat with improved error handling and logging"""
@@ -185,14 +254,29 @@ def interactive_chat():
                 break
             
             if query.lower() == "clear":
+                global semantic_cache_matrix
                 embedding_cache.clear()
+                semantic_cache_matrix = np.empty((0, 768), dtype=np.float16)
+                semantic_cache_answers.clear()
                 print("✓ Cache cleared")
                 continue
             
             logger.info(f"User query: {query}")
-            
+
+            # Check the semantic cache before running the full pipeline
+            vec = embed_text(query)
+            cached_answer, sim = semantic_cache_lookup(vec)
+            if cached_answer is not None:
+                logger.info(f"Semantic cache hit (sim={sim:.3f})")
+                print("\n" + "=" * 60)
+                print("🤖 Assistant Answer (cached):")
+                print("=" * 60)
+                print(cached_answer)
+                print("=" * 60)
+                continue
+
             # Retrieve context
-            matches = pinecone_query(query, top_k=5)
+            matches = pinecone_query(query, top_k=5, vec=vec)
             
             if not matches:
                 print("\n⚠️ No relevant results found. Try rephrasing your question.")
@@ -204,7 +288,13 @@ def interactive_chat():
             # Generate response
             prompt = build_prompt(query, matches, graph_facts)
             answer = call_groq_chat(prompt)
-            
+            if answer is None:
+                # A transient Groq failure must not poison the semantic
+                # cache for this query and its paraphrases
+                print("\n⚠️ Trouble generating a response right now. Please try again.")
+                continue
+            semantic_cache_store(vec, answer)
+
             print("\n" + "=" * 60)
             print("🤖 Assistant Answer:")
             print("=" * 60)
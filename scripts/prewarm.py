@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+import logging
+import numpy as np
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from hybrid_chat import (
+    embed_text, pinecone_query, fetch_graph_context, build_prompt, call_groq_chat
+)
+
+QUERIES_FILE = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', 'data', 'prewarm_queries.json'))
+CACHE_FILE = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', 'data', 'semantic_cache.npz'))
+
+
+def main():
+    """Run the full RAG pipeline offline for each canonical query and dump
+    (embedding, answer) pairs for the app to preload into its semantic cache"""
+    with open(QUERIES_FILE, "r", encoding="utf-8") as f:
+        queries = json.load(f)
+    logger.info(f"Pre-warming semantic cache with {len(queries)} queries")
+
+    embeddings = []
+    answers = []
+    for i, query in enumerate(queries, 1):
+        try:
+            vec = embed_text(query)
+            matches = pinecone_query(query, top_k=5, vec=vec)
+            match_ids = [m["id"] for m in matches]
+            graph_facts = fetch_graph_context(match_ids)
+            prompt = build_prompt(query, matches, graph_facts)
+            answer = call_groq_chat(prompt)
+            if answer is None:
+                logger.warning(f"[{i}/{len(queries)}] Groq failed for '{query}'; skipping")
+                continue
+
+            embeddings.append(np.asarray(vec, dtype=np.float32))
+            answers.append(answer)
+            logger.info(f"[{i}/{len(queries)}] Cached answer for: {query}")
+        except Exception as e:
+            logger.error(f"[{i}/{len(queries)}] Failed for '{query}': {e}")
+
+    if not embeddings:
+        logger.error("No answers generated; nothing to save")
+        sys.exit(1)
+
+    np.savez(
+        CACHE_FILE,
+        embeddings=np.vstack(embeddings),
+        answers=np.array(answers, dtype=object)
+    )
+    logger.info(f"Saved {len(answers)} cached answers to {CACHE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
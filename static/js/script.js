@@ -94,17 +94,45 @@ async function sendMessage() {
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
-        
-        const data = await response.json();
-        
-        // Add bot response
-        addMessage(data.response, 'bot');
-        
+
+        // Stream the server-sent events, rendering tokens as they arrive
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        let contextData = null;
+        let contentDiv = null;
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            for (const event of events) {
+                if (!event.startsWith('data: ')) continue;
+                const data = JSON.parse(event.slice(6));
+
+                if (data.type === 'context') {
+                    contextData = data;
+                } else if (data.type === 'token') {
+                    if (!contentDiv) {
+                        showLoading(false);
+                        contentDiv = addMessage('', 'bot');
+                    }
+                    answer += data.content;
+                    contentDiv.innerHTML = formatMessageText(answer);
+                }
+            }
+        }
+
         // Optionally show matched nodes
-        if (data.graph_nodes && data.graph_nodes.length > 0) {
-            addContextInfo(data.matches, data.graph_nodes);
+        if (contextData && contextData.graph_nodes && contextData.graph_nodes.length > 0) {
+            addContextInfo(contextData.matches, contextData.graph_nodes);
         }
-        
+
     } catch (error) {
         console.error('Error:', error);
         addMessage('Sorry, I encountered an error. Please try again.', 'bot');
@@ -138,9 +166,12 @@ function addMessage(text, sender) {
     messageDiv.appendChild(avatar);
     messageDiv.appendChild(content);
     messagesContainer.appendChild(messageDiv);
-    
+
     // Scroll to bottom
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
+
+    // Return the content element so streamed responses can update it
+    return content;
 }
 
 function formatMessageText(text) {